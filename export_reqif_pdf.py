@@ -2,171 +2,281 @@
 # -*- coding: utf-8 -*-
 
 
-import xml.etree.ElementTree as ET
-import re
+import io
+import sys
+from functools import lru_cache
 from pathlib import Path
 from html import unescape
 
+from lxml import etree
+from PIL import Image
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
 from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+
+REQIF_NS = "http://www.omg.org/spec/ReqIF/20110401/reqif.xsd"
+XHTML_NS = "http://www.w3.org/1999/xhtml"
+NAMESPACES = {"reqif": REQIF_NS, "xhtml": XHTML_NS}
+
+# tags em notação Clark, comparados diretamente com elem.tag
+REQIF_SPEC_OBJECT = f"{{{REQIF_NS}}}SPEC-OBJECT"
+REQIF_SPECIFICATION = f"{{{REQIF_NS}}}SPECIFICATION"
+REQIF_SPEC_HIERARCHY = f"{{{REQIF_NS}}}SPEC-HIERARCHY"
+XHTML_IMG = f"{{{XHTML_NS}}}img"
+XHTML_OBJECT = f"{{{XHTML_NS}}}object"
+
+# sufixos de ATTRIBUTE-DEFINITION-XHTML-REF usados no PDF
+XHTML_ATTRIBUTES = ("OBJECTHEADING", "OBJECTTEXT")
+
+
+@lru_cache(maxsize=None)
+def _glyph_widths(font_name):
+    """Larguras por byte cp1252 (WinAnsi), em unidades de 1/1000 pt."""
+    widths = [0.0] * 256
+    for code in range(256):
+        try:
+            char = bytes([code]).decode("cp1252")
+        except UnicodeDecodeError:
+            continue
+        widths[code] = stringWidth(char, font_name, 1000)
+    return widths
+
+
+@lru_cache(maxsize=8192)
+def word_width(word, font_name="Helvetica", font_size=10):
+    """Largura em pontos; requisitos repetem muito o mesmo vocabulário."""
+    try:
+        codes = word.encode("cp1252")
+    except UnicodeEncodeError:
+        return stringWidth(word, font_name, font_size)
+    widths = _glyph_widths(font_name)
+    return sum(map(widths.__getitem__, codes)) * font_size / 1000
+
+
+def extract_xhtml(element, base_dir):
+    """
+    Retorna lista ordenada de conteúdo XHTML:
+    ("text", str)
+    ("image", Path)
+    ("ole", Path)
+    """
+    content = []
+    if element is None:
+        return content
+
+    # percurso iterativo: "start" emite o nó e seu texto, "end" o tail
+    for event, node in etree.iterwalk(element, events=("start", "end")):
+        if event == "start":
+            # lxml cria um novo str a cada acesso a .tag
+            tag = node.tag
+            if tag == XHTML_IMG:
+                src = node.get("src")
+                if src:
+                    content.append(("image", base_dir / src))
+
+            elif tag == XHTML_OBJECT:
+                data = node.get("data")
+                if data:
+                    content.append(("ole", base_dir / data))
+
+            if node.text:
+                txt = " ".join(node.text.split())
+                if txt:
+                    if "&" in txt:
+                        txt = unescape(txt)
+                    content.append(("text", txt))
+
+        elif node is not element and node.tail:
+            tail = " ".join(node.tail.split())
+            if tail:
+                if "&" in tail:
+                    tail = unescape(tail)
+                content.append(("text", tail))
+
+    return content
+
+
+def extract_text(element):
+    """Só o texto do XHTML (usado no heading), sem classificar o conteúdo."""
+    text = " ".join(" ".join(element.itertext()).split())
+    return unescape(text) if "&" in text else text
+
+
+def extract_values(base_dir, heading, text):
+    """(heading, conteúdo) de um SPEC-OBJECT a partir dos seus THE-VALUE."""
+    return (
+        extract_text(heading) if heading is not None else "",
+        extract_xhtml(text, base_dir),
+    )
+
+
+class Requirement:
+    """Um SPEC-OBJECT já convertido; __slots__ evita um dict por objeto."""
+
+    __slots__ = ("req_id", "heading", "content", "level", "hnum")
+
+    def __init__(self, req_id, heading="", content=None, level=0, hnum=""):
+        self.req_id = req_id
+        self.heading = heading
+        self.content = content if content is not None else []
+        self.level = level
+        self.hnum = hnum
 
 
 class ReqIFExtractor:
+    # XPaths compiladas uma única vez (evita reinterpretar a expressão
+    # e o prefixo "reqif:" a cada SPEC-OBJECT)
+    _XP_INT = etree.XPath(
+        "reqif:VALUES/reqif:ATTRIBUTE-VALUE-INTEGER", namespaces=NAMESPACES
+    )
+    _XP_XHTML_VALUES = etree.XPath(
+        "reqif:VALUES/reqif:ATTRIBUTE-VALUE-XHTML", namespaces=NAMESPACES
+    )
+    _XP_XHTML_REF = etree.XPath(
+        "reqif:DEFINITION/reqif:ATTRIBUTE-DEFINITION-XHTML-REF",
+        namespaces=NAMESPACES,
+    )
+    _XP_THE_VALUE = etree.XPath("reqif:THE-VALUE", namespaces=NAMESPACES)
+    _XP_REF = etree.XPath("reqif:OBJECT/reqif:SPEC-OBJECT-REF", namespaces=NAMESPACES)
+    _XP_CHILDREN = etree.XPath("reqif:CHILDREN", namespaces=NAMESPACES)
+
     def __init__(self, reqif_file: str):
         self.reqif_file = Path(reqif_file).resolve()
         self.base_dir = self.reqif_file.parent
 
-        self.namespaces = {
-            "reqif": "http://www.omg.org/spec/ReqIF/20110401/reqif.xsd",
-            "xhtml": "http://www.w3.org/1999/xhtml",
-        }
+        self.namespaces = NAMESPACES
 
-        self.tree = None
-        self.root = None
         self.objects = {}
         self.hierarchy = []
+        self._hierarchy_refs = []
+        self._file_cache = {}
+        self._img_cache = {}
+        self._thumb_cache = {}
 
     # ---------------------------------------------------------
     # PARSE
     # ---------------------------------------------------------
     def parse(self):
-        print(f"Parseando: {self.reqif_file.name}")
-        self.tree = ET.parse(self.reqif_file)
-        self.root = self.tree.getroot()
-
-    # ---------------------------------------------------------
-    # XHTML → TEXTO / IMAGEM / OLE
-    # ---------------------------------------------------------
-    def extract_xhtml(self, element):
         """
-        Retorna lista ordenada de conteúdo XHTML:
-        ("text", str)
-        ("image", Path)
-        ("ole", Path)
+        Leitura em streaming: cada SPEC-OBJECT / SPECIFICATION é processado
+        ao fechar e descartado em seguida. O schema não fixa a ordem entre
+        SPEC-OBJECTS e SPECIFICATIONS, então as referências da hierarquia
+        só são resolvidas depois de lido o arquivo inteiro.
         """
-        content = []
-
-        def walk(elem):
-            if elem.text and elem.text.strip():
-                txt = re.sub(r"\s+", " ", elem.text.strip())
-                content.append(("text", unescape(txt)))
-
-            for child in elem:
-                tag = child.tag.split("}")[-1]
-
-                if tag == "img":
-                    src = child.attrib.get("src")
-                    if src:
-                        content.append(
-                            ("image", (self.base_dir / src).resolve())
-                        )
-
-                elif tag == "object":
-                    data = child.attrib.get("data")
-                    if data:
-                        content.append(
-                            ("ole", (self.base_dir / data).resolve())
-                        )
-
-                walk(child)
-
-                if child.tail and child.tail.strip():
-                    tail = re.sub(r"\s+", " ", child.tail.strip())
-                    content.append(("text", unescape(tail)))
+        print(f"Parseando: {self.reqif_file.name}")
+        for _, elem in etree.iterparse(
+            str(self.reqif_file),
+            events=("end",),
+            tag=(REQIF_SPEC_OBJECT, REQIF_SPECIFICATION),
+            huge_tree=True,
+            remove_comments=True,
+            remove_pis=True,
+        ):
+            if elem.tag == REQIF_SPEC_OBJECT:
+                self.extract_object(elem)
+            else:
+                self.extract_hierarchy(elem)
 
-        if element is not None:
-            walk(element)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
 
-        return content
+        self.resolve_hierarchy()
 
     # ---------------------------------------------------------
     # ATRIBUTOS XHTML
     # ---------------------------------------------------------
-    def get_xhtml_attribute(self, spec_obj, name):
-        values = spec_obj.find("reqif:VALUES", self.namespaces)
-        if values is None:
-            return []
-
-        for val in values:
-            ref = val.find(
-                ".//reqif:ATTRIBUTE-DEFINITION-XHTML-REF",
-                self.namespaces,
-            )
-            if ref is not None and name in ref.text:
-                the_val = val.find(
-                    ".//reqif:THE-VALUE",
-                    self.namespaces,
-                )
-                return self.extract_xhtml(the_val)
+    def get_xhtml_attributes(self, spec_obj):
+        """
+        Mapeia cada nome de XHTML_ATTRIBUTES para o seu THE-VALUE,
+        percorrendo só os valores XHTML e parando quando todos forem achados.
+        """
+        attrs = {}
+        for val in self._XP_XHTML_VALUES(spec_obj):
+            if len(attrs) == len(XHTML_ATTRIBUTES):
+                break
 
-        return []
+            ref = self._XP_XHTML_REF(val)
+            if not ref or not ref[0].text:
+                continue
+
+            ref_text = ref[0].text.strip()
+            for name in XHTML_ATTRIBUTES:
+                if name not in attrs and ref_text.endswith(name):
+                    the_val = self._XP_THE_VALUE(val)
+                    attrs[name] = the_val[0] if the_val else None
+
+        return attrs
 
     # ---------------------------------------------------------
     # SPEC OBJECTS
     # ---------------------------------------------------------
-    def extract_objects(self):
-        objs = self.root.find(".//reqif:SPEC-OBJECTS", self.namespaces)
-
-        for obj in objs.findall("reqif:SPEC-OBJECT", self.namespaces):
-            oid = obj.get("IDENTIFIER")
-
-            num_elem = obj.find(
-                ".//reqif:ATTRIBUTE-VALUE-INTEGER",
-                self.namespaces,
-            )
-            number = num_elem.get("THE-VALUE") if num_elem is not None else ""
-
-            heading = ""
-            for t, v in self.get_xhtml_attribute(obj, "OBJECTHEADING"):
-                if t == "text":
-                    heading += v + " "
-
-            content = self.get_xhtml_attribute(obj, "OBJECTTEXT")
-
-            self.objects[oid] = {
-                "req_id": f"REQ-{number.zfill(6)}"
-                if number.isdigit()
-                else oid,
-                "heading": heading.strip(),
-                "content": content,
-                "level": 0,
-                "hnum": "",
-            }
+    def extract_object(self, obj):
+        # mesmas strings de SPEC-OBJECT-REF resolvem para o mesmo objeto
+        oid = sys.intern(obj.get("IDENTIFIER", ""))
+
+        req_id = oid
+        num_elem = self._XP_INT(obj)
+        if num_elem:
+            # int() também aceita " 42", "+42" e "1_000"; isdecimal mantém
+            # só valores formados por dígitos
+            number = num_elem[0].get("THE-VALUE", "")
+            if number.isdecimal():
+                req_id = f"REQ-{int(number):06d}"
+
+        attrs = self.get_xhtml_attributes(obj)
+        heading, content = extract_values(
+            self.base_dir, attrs.get("OBJECTHEADING"), attrs.get("OBJECTTEXT")
+        )
+
+        self.objects[oid] = Requirement(req_id, heading, content)
 
     # ---------------------------------------------------------
     # HIERARQUIA + NUMERAÇÃO
     # ---------------------------------------------------------
-    def extract_hierarchy(self):
-        specs = self.root.find(".//reqif:SPECIFICATIONS", self.namespaces)
-
-        for spec in specs.findall("reqif:SPECIFICATION", self.namespaces):
-            children = spec.find("reqif:CHILDREN", self.namespaces)
-            if children is not None:
-                self._walk_hierarchy(children, [], 0)
-
-    def _walk_hierarchy(self, parent, counters, level):
-        index = 0
-
-        for sh in parent.findall("reqif:SPEC-HIERARCHY", self.namespaces):
-            index += 1
-            current = counters[:level] + [index]
-            hnum = ".".join(str(i) for i in current)
-
-            ref = sh.find(
-                "reqif:OBJECT/reqif:SPEC-OBJECT-REF",
-                self.namespaces,
-            )
-            if ref is not None and ref.text in self.objects:
-                obj = self.objects[ref.text]
-                obj["level"] = level
-                obj["hnum"] = hnum
-                self.hierarchy.append(ref.text)
-
-            children = sh.find("reqif:CHILDREN", self.namespaces)
-            if children is not None:
-                self._walk_hierarchy(children, current, level + 1)
+    def extract_hierarchy(self, spec):
+        children = self._XP_CHILDREN(spec)
+        if children:
+            self._walk_hierarchy(children[0])
+
+    def _walk_hierarchy(self, root):
+        # counters[-1] conta os irmãos no nível atual; hnums guarda a
+        # numeração do pai, então cada hnum é montado em O(1)
+        counters = [0]
+        hnums = [""]
+
+        for event, sh in etree.iterwalk(
+            root, events=("start", "end"), tag=REQIF_SPEC_HIERARCHY
+        ):
+            if event == "end":
+                counters.pop()
+                hnums.pop()
+                continue
+
+            counters[-1] += 1
+            parent = hnums[-1]
+            hnum = f"{parent}.{counters[-1]}" if parent else str(counters[-1])
+
+            ref = self._XP_REF(sh)
+            if ref and ref[0].text:
+                self._hierarchy_refs.append(
+                    (sys.intern(ref[0].text), len(counters) - 1, hnum)
+                )
+
+            counters.append(0)
+            hnums.append(hnum)
+
+    def resolve_hierarchy(self):
+        refs, self._hierarchy_refs = self._hierarchy_refs, []
+        for oid, level, hnum in refs:
+            obj = self.objects.get(oid)
+            if obj is not None:
+                obj.level = level
+                obj.hnum = hnum
+                self.hierarchy.append(oid)
 
     # ---------------------------------------------------------
     # PDF
@@ -176,49 +286,93 @@ class ReqIFExtractor:
         width, height = A4
         margin = 20 * mm
         y = height - margin
+        bottom = margin + 80
+
+        # métodos usados a cada requisito/linha, resolvidos uma única vez
+        objects = self.objects
+        wrap = self.wrap
+        draw_string = c.drawString
+        set_font = c.setFont
+
+        # sequência de OLEs: a cor azul é trocada uma vez e OLEs seguidos
+        # com o mesmo destino compartilham um único link [alvo, x0, y0, x1, y1]
+        link = None
+        blue = False
+
+        def flush_link():
+            nonlocal link
+            if link is not None:
+                c.linkURL(link[0], tuple(link[1:]), relative=1)
+                link = None
+
+        def end_ole_run():
+            nonlocal blue
+            flush_link()
+            if blue:
+                c.setFillColorRGB(0, 0, 0)
+                blue = False
 
         def new_page():
             nonlocal y
+            end_ole_run()
             c.showPage()
-            c.setFont("Helvetica", 10)
+            set_font("Helvetica", 10)
             y = height - margin
 
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(margin, y, "DOCUMENTO DE REQUISITOS")
+        def begin_text(x):
+            tob = c.beginText(x, y)
+            tob.setFont("Helvetica", 10, leading=12)
+            return tob
+
+        set_font("Helvetica-Bold", 16)
+        draw_string(margin, y, "DOCUMENTO DE REQUISITOS")
         y -= 20
-        c.setFont("Helvetica", 10)
+        set_font("Helvetica", 10)
 
         for oid in self.hierarchy:
-            obj = self.objects[oid]
-            indent = margin + obj["level"] * 12
+            obj = objects[oid]
+            indent = margin + obj.level * 12
 
-            if y < margin + 80:
+            if y < bottom:
                 new_page()
 
-            c.setFont("Helvetica-Bold", 10)
-            title = f"{obj['hnum']} [{obj['req_id']}] {obj['heading']}"
-            c.drawString(indent, y, title)
+            set_font("Helvetica-Bold", 10)
+            title = f"{obj.hnum} [{obj.req_id}] {obj.heading}"
+            draw_string(indent, y, title)
             y -= 14
-            c.setFont("Helvetica", 10)
+            set_font("Helvetica", 10)
+
+            for kind, val in obj.content:
+                if kind != "ole":
+                    end_ole_run()
 
-            for kind, val in obj["content"]:
-                if y < margin + 80:
+                if y < bottom:
                     new_page()
 
                 if kind == "text":
-                    for line in self.wrap(val, 90):
-                        c.drawString(indent + 10, y, line)
-                        y -= 12
-
-                elif kind == "image" and val.exists():
-                    img = ImageReader(str(val))
-                    iw, ih = img.getSize()
+                    # um único bloco BT/ET por fragmento, não um por linha
+                    tob = begin_text(indent + 10)
+                    for line in wrap(val, width - margin - indent - 10):
+                        if tob.getY() < bottom:
+                            c.drawText(tob)
+                            new_page()
+                            tob = begin_text(indent + 10)
+                        tob.textLine(line)
+                    c.drawText(tob)
+                    y = tob.getY()
+
+                elif kind == "image":
+                    path = self.find_file(val)
+                    if path is None:
+                        continue
+
+                    img, iw, ih = self.load_image(path)
                     scale = min(
                         (width - indent - 20) / iw,
                         200 / ih,
                     )
                     c.drawImage(
-                        img,
+                        self.fit_image(path, iw * scale, ih * scale),
                         indent + 10,
                         y - ih * scale,
                         iw * scale,
@@ -227,47 +381,105 @@ class ReqIFExtractor:
                     y -= ih * scale + 10
 
                 elif kind == "ole":
+                    if not blue:
+                        c.setFillColorRGB(0, 0, 1)
+                        blue = True
+
                     label = f"📎 Abrir objeto OLE: {val.name}"
-                    c.setFillColorRGB(0, 0, 1)
-                    c.drawString(indent + 10, y, label)
-                    c.linkURL(
-                        val.name,
-                        (indent + 10, y - 2, indent + 260, y + 10),
-                        relative=1,
-                    )
-                    c.setFillColorRGB(0, 0, 0)
+                    draw_string(indent + 10, y, label)
+
+                    if link is not None and link[0] == val.name:
+                        link[2] = y - 2
+                    else:
+                        flush_link()
+                        link = [val.name, indent + 10, y - 2, indent + 260, y + 10]
                     y -= 14
 
+            end_ole_run()
             y -= 10
 
         c.save()
         print(f"PDF gerado com sucesso: {output_pdf}")
 
     # ---------------------------------------------------------
-    def wrap(self, text, max_len):
-        words = text.split()
-        lines, cur = [], ""
-        for w in words:
-            if len(cur) + len(w) + 1 <= max_len:
-                cur = f"{cur} {w}".strip()
+    def find_file(self, path):
+        """
+        Caminho resolvido se o arquivo existir, senão None. O resultado
+        fica em cache: logos repetidos custam um único stat.
+        """
+        try:
+            return self._file_cache[path]
+        except KeyError:
+            resolved = path.resolve()
+            found = resolved if resolved.exists() else None
+            self._file_cache[path] = found
+            return found
+
+    def load_image(self, path):
+        """
+        Retorna (ImageReader, largura, altura), decodificando cada arquivo
+        uma única vez mesmo que seja referenciado por vários requisitos.
+        """
+        cached = self._img_cache.get(path)
+        if cached is None:
+            img = ImageReader(str(path))
+            cached = self._img_cache[path] = (img, *img.getSize())
+        return cached
+
+    def fit_image(self, path, box_w, box_h):
+        """
+        Reduz a imagem para ~2 px por ponto da caixa onde será desenhada
+        (JPEG q85, ou PNG se houver transparência), para não embutir
+        capturas de tela na resolução original.
+        """
+        target = (max(1, round(box_w * 2)), max(1, round(box_h * 2)))
+        cached = self._thumb_cache.get((path, target))
+        if cached is not None:
+            return cached
+
+        img, iw, ih = self.load_image(path)
+        if iw <= target[0] and ih <= target[1]:
+            cached = img
+        else:
+            with Image.open(path) as im:
+                has_alpha = im.mode in ("RGBA", "LA") or "transparency" in im.info
+                im = im.convert("RGBA" if has_alpha else "RGB")
+            im.thumbnail(target, Image.LANCZOS)
+
+            buf = io.BytesIO()
+            if has_alpha:
+                im.save(buf, "PNG", optimize=True)
+            else:
+                im.save(buf, "JPEG", quality=85)
+            buf.seek(0)
+            cached = ImageReader(buf)
+
+        self._thumb_cache[(path, target)] = cached
+        return cached
+
+    # ---------------------------------------------------------
+    def wrap(self, text, max_width):
+        space_w = word_width(" ")
+        lines, cur, cur_w = [], [], 0.0
+        for w in text.split():
+            w_w = word_width(w)
+            if cur and cur_w + space_w + w_w > max_width:
+                lines.append(" ".join(cur))
+                cur, cur_w = [w], w_w
             else:
-                lines.append(cur)
-                cur = w
+                cur_w += space_w + w_w if cur else w_w
+                cur.append(w)
         if cur:
-            lines.append(cur)
+            lines.append(" ".join(cur))
         return lines
 
     # ---------------------------------------------------------
     def run(self, output_pdf):
         self.parse()
-        self.extract_objects()
-        self.extract_hierarchy()
         self.generate_pdf(output_pdf)
 
 
 def main():
-    import sys
-
     reqif = sys.argv[1] if len(sys.argv) > 1 else "_SRS_Export_Sprint_16.0.reqif"
     pdf = sys.argv[2] if len(sys.argv) > 2 else "SRS_Export_Sprint_16.0.pdf"
 